@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# hhjit.py ---
+#
+# Filename: hhjit.py
+# Description: Fused elementwise kernels for building HH rate tables.
+# Maintainer:
+# Version:
+# URL:
+# Keywords:
+# Compatibility:
+#
+#
+
+# Commentary:
+#
+# createHHChannel combines the alpha/beta (or inf/tau) rate tables into
+# the moose tableA/tableB arrays with a handful of elementwise NumPy
+# expressions, each of which allocates intermediate arrays and makes a
+# separate pass over memory. The helpers here fuse each combination
+# into a single pass. When numba is installed the kernels are JIT
+# compiled; otherwise plain NumPy fallbacks keep the behaviour
+# identical.
+#
+#
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street, Fifth
+# Floor, Boston, MA 02110-1301, USA.
+#
+#
+
+# Code:
+
+import numpy as np
+
+try:
+    from numba import njit
+    _have_numba = True
+except ImportError:
+    _have_numba = False
+
+
+if _have_numba:
+
+    @njit(cache=True, fastmath=True)
+    def fuse_ab(q10, alpha, beta, tableA, tableB):
+        """Compute (q10*alpha, q10*(alpha+beta)) in one pass, writing
+        into the supplied output buffers."""
+        for ii in range(alpha.shape[0]):
+            a = alpha[ii]
+            tableA[ii] = q10 * a
+            tableB[ii] = q10 * (a + beta[ii])
+        return tableA, tableB
+
+    @njit(cache=True, fastmath=True)
+    def fuse_inf_tau(q10, inf, tau, tableA, tableB):
+        """Compute (q10*inf/tau, q10/tau) in one pass, writing into the
+        supplied output buffers."""
+        for ii in range(inf.shape[0]):
+            b = q10 / tau[ii]
+            tableA[ii] = b * inf[ii]
+            tableB[ii] = b
+        return tableA, tableB
+
+else:
+
+    def fuse_ab(q10, alpha, beta, tableA, tableB):
+        """Compute (q10*alpha, q10*(alpha+beta)) into the supplied
+        output buffers. NumPy fallback."""
+        np.multiply(alpha, q10, out=tableA)
+        np.add(alpha, beta, out=tableB)
+        tableB *= q10
+        return tableA, tableB
+
+    def fuse_inf_tau(q10, inf, tau, tableA, tableB):
+        """Compute (q10*inf/tau, q10/tau) into the supplied output
+        buffers. NumPy fallback."""
+        np.divide(q10, tau, out=tableB)
+        np.multiply(tableB, inf, out=tableA)
+        return tableA, tableB
+
+
+#
+# hhjit.py ends here
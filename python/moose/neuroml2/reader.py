@@ -58,14 +58,17 @@ try:
 except ImportError:
     pass
 import sys, os
+import re
 import numpy as np
 from moose.neuroml2.hhfit import exponential2
 from moose.neuroml2.hhfit import sigmoid2
 from moose.neuroml2.hhfit import linoid2
 from moose.neuroml2.units import SI
+from moose.neuroml2.hhjit import fuse_ab, fuse_inf_tau
 import moose
 import logging
-import math
+from collections import namedtuple
+from functools import lru_cache
 
 loglevel = logging.DEBUG
 logstream = logging.StreamHandler()
@@ -133,6 +136,87 @@ def setEk(comp, erev):
     """Set reversal potential"""
     comp.setEm(erev)
 
+# Explicit input targets look like 'population[index]' with an optional
+# '/segment' suffix; matched in one go instead of repeated splits.
+_target_rex = re.compile(r'^([^\[]+)\[(\d+)\](?:/(\d+))?$')
+
+
+def _bulk_set(field, comps, values):
+    """Assign `values` to `field` of every element in `comps`. `values`
+    may be a scalar, which is broadcast to all elements.
+
+    When the elements are exactly the members, in order, of one
+    underlying moose vec the assignment is made on the vec in a single
+    call instead of one binding crossing per element; compartments
+    created individually fall back to a plain loop.
+    """
+    if len(comps) > 1:
+        try:
+            vec = comps[0].vec
+            if len(vec) == len(comps) and all(
+                    comps[ii].vec == vec and comps[ii].dindex == ii
+                    for ii in range(len(comps))):
+                setattr(vec, field, values)
+                return
+        except (AttributeError, TypeError):
+            pass
+    if np.isscalar(values):
+        for comp in comps:
+            setattr(comp, field, values)
+    else:
+        for comp, value in zip(comps, values):
+            setattr(comp, field, value)
+
+
+# Precomputed geometry of one segment, in SI units. Cached per cell by
+# createMorphology so the property importers do not recompute areas by
+# reading length and diameter back through the moose bindings.
+SegGeom = namedtuple('SegGeom', ['length', 'diameter', 'sarea', 'xarea'])
+
+
+def _iter_nml_elements(filename, tags=None):
+    """Iterate over the top-level elements of NeuroML file `filename`
+    with a streaming lxml parser, yielding (tag, element) pairs with
+    the namespace stripped from the tag. If `tags` is given, only
+    elements with those tags are yielded. Each consumed element and
+    its already-consumed siblings are cleared from the tree, so the
+    working set stays small however large the file is - unlike
+    loaders.read_neuroml2_file, which materializes the whole document.
+    """
+    from lxml import etree
+    context = etree.iterparse(filename, events=('start', 'end'))
+    root = None
+    for event, elem in context:
+        if event == 'start':
+            if root is None:
+                root = elem
+            continue
+        if elem.getparent() is not root:
+            continue
+        tag = elem.tag.split('}')[-1]
+        if tags is None or tag in tags:
+            yield tag, elem
+        elem.clear()
+        while elem.getprevious() is not None:
+            del root[0]
+    del context
+
+
+def _scanDeclaredIds(filename):
+    """Return a dict mapping each top-level element tag in `filename` to
+    the list of ids it declares (hrefs for `include` elements, names
+    for ComponentTypes). Uses the streaming parser so a file can be
+    inspected without building its document object model."""
+    declared = {}
+    for tag, elem in _iter_nml_elements(filename):
+        if tag == 'include':
+            value = elem.get('href')
+        else:
+            value = elem.get('id') or elem.get('name')
+        if value is not None:
+            declared.setdefault(tag, []).append(value)
+    return declared
+
 
 def getSegments(nmlcell, component, sg_to_segments):
     """Get the list of segments the `component` is applied to"""
@@ -146,11 +230,11 @@ def getSegments(nmlcell, component, sg_to_segments):
         segments = sg_to_segments[sg]
         
     unique_segs = []
-    unique_segs_ids = []
+    unique_segs_ids = set()
     for s in segments:
         if not s.id in unique_segs_ids:
             unique_segs.append(s)
-            unique_segs_ids.append(s.id)
+            unique_segs_ids.add(s.id)
     return unique_segs
 
 
@@ -168,11 +252,18 @@ class NML2Reader(object):
 
     creates a passive neuronal morphology `/library/Purk2M9s`.
     """
-    def __init__(self, verbose=False):
+    def __init__(self, verbose=False, temperature=None):
+        """`temperature` (SI float) presets the model temperature; used
+        for nested readers of included files, whose own documents carry
+        no network element to take it from."""
         self.lunit = 1e-6 # micron is the default length unit
         self.verbose = verbose
+        self._symmetric = True
+        self._default_temperature = temperature
         self.doc = None
-        self.filename = None        
+        self.filename = None
+        self.network = None
+        self._temperature = temperature # resolved once per model by _getTemperature
         self.nml_cells_to_moose = {} # NeuroML object to MOOSE object
         self.nml_segs_to_moose = {} # NeuroML object to MOOSE object
         self.nml_chans_to_moose = {} # NeuroML object to MOOSE object
@@ -185,19 +276,52 @@ class NML2Reader(object):
         self.lib = moose.Neutral('/library')
         self.id_to_ionChannel = {}
         self._cell_to_sg = {} # nml cell to dict - the dict maps segment groups to segments
+        self._seg_geom = {} # nml cell id to dict - segment id to SegGeom
+        self._comp_lookup = {} # (pop id, cell index, segment id) to moose compartment
+        self._rate_cache = {} # rate fn parameters to computed table
+        self._chan_to_gates = {} # channel id to list of (nml gate id, moose gate name)
+        self._vtab_cache = {} # (vmin, vmax, tablen) to voltage sample array
+        self._table_bufs = {} # table length to reusable (tableA, tableB) buffers
+        self._q10_cache = {} # (q10 factor, experimental temp) to scale factor
         
         self.cells_in_populations = {}
         self.pop_to_cell_type = {}
         self.seg_id_to_comp_name = {}
         self.paths_to_chan_elements = {}
+        self._comp_type_eval = {} # ComponentType name to compiled batch evaluator (None if not batchable)
+        self._seg_cache = {} # (cell id, segment group id) to unique segment list
+        self._include_hrefs = [] # hrefs of <include> elements, loaded on demand
+        self._include_decls = {} # href to set of ids the file declares (None if unknown)
+        self._load_include = lru_cache(maxsize=16)(self._load_include)
+
+    def read(self, filename, symmetric=True, include_includes=False):
+        """Read the NeuroML2 model in `filename`. Included files are
+        loaded lazily by default: their hrefs are recorded and each
+        file is parsed only when an id it declares is actually
+        referenced. Pass include_includes=True to merge all includes
+        into the document up front as before."""
+        # A reader may be reused for several models; the cached
+        # temperature belongs to the previous document, so fall back to
+        # the constructor preset (None except for include readers).
+        self._temperature = self._default_temperature
+        # The q10 scales and custom rate tables were evaluated at the
+        # previous model's temperature, and the remaining caches are
+        # keyed by ids that may recur across documents with different
+        # contents, so none of them survive a re-read.
+        self._q10_cache.clear()
+        self._rate_cache.clear()
+        self._comp_type_eval.clear()
+        self._seg_cache.clear()
+        self._comp_lookup.clear()
+        self.doc = loaders.read_neuroml2_file(filename, include_includes=include_includes, verbose=self.verbose)
 
-    def read(self, filename, symmetric=True):
-        self.doc = loaders.read_neuroml2_file(filename, include_includes=True, verbose=self.verbose)
-        
         if self.verbose:
             print('Parsed NeuroML2 file: %s'% filename)
         self.filename = filename
-        
+        self._symmetric = symmetric
+        if not include_includes:
+            self._include_hrefs = [inc.href for inc in self.doc.includes]
+
         if len(self.doc.networks)>=1:
             self.network = self.doc.networks[0]
             
@@ -217,20 +341,38 @@ class NML2Reader(object):
         print("Read all from %s"%filename)
         
     def _getTemperature(self):
-        if self.network.type=="networkWithTemperature":
-            return SI(self.network.temperature)
-        else:
-            return 0 # Why not, if there's no temp dependence in nml..?
+        # SI() parses the unit string, and the temperature is consulted
+        # for every q10 gate and custom rate evaluation - resolve once.
+        if self._temperature is None:
+            if self.network is not None and self.network.type=="networkWithTemperature":
+                self._temperature = SI(self.network.temperature)
+            else:
+                self._temperature = 0 # Why not, if there's no temp dependence in nml..?
+        return self._temperature
         
     def getCellInPopulation(self, pop_id, index):
         return self.cells_in_populations[pop_id][index]
     
     def getComp(self, pop_id, cellIndex, segId):
-        return moose.element('%s/%s/%s/%s' % (self.lib.path, pop_id, cellIndex, self.seg_id_to_comp_name[self.pop_to_cell_type[pop_id]][segId]))
+        """Return the moose compartment for segment `segId` of cell
+        `cellIndex` in population `pop_id`. Resolved elements are
+        cached, so repeated lookups (one per connection when wiring up
+        inputs) cost a dict fetch instead of a path format and a moose
+        path walk."""
+        key = (pop_id, int(cellIndex), int(segId))
+        comp = self._comp_lookup.get(key)
+        if comp is None:
+            comp = moose.element('%s/%s/%s/%s' % (
+                self.lib.path, pop_id, key[1],
+                self.seg_id_to_comp_name[self.pop_to_cell_type[pop_id]][key[2]]))
+            self._comp_lookup[key] = comp
+        return comp
             
     def createPopulations(self):
         for pop in self.network.populations:
             mpop = moose.Neutral('%s/%s' % (self.lib.path, pop.id))
+            if pop.component not in self.proto_cells:
+                self._loadIncludesFor(pop.component)
             self.cells_in_populations[pop.id] ={}
             for i in range(pop.size):
                 print("Creating %s/%s instances of %s under %s"%(i,pop.size,pop.component, mpop))
@@ -240,16 +382,30 @@ class NML2Reader(object):
                 
                 
     def getInput(self, input_id):
-        return moose.element('%s/inputs/%s'%(self.lib.path,input_id))
+        path = '%s/inputs/%s' % (self.lib.path, input_id)
+        if not moose.exists(path):
+            # The generator may be declared in an unparsed include; a
+            # nested reader's importInputs creates it under the shared
+            # /library/inputs.
+            self._loadIncludesFor(input_id)
+        if not moose.exists(path):
+            raise Exception('No input with id %s' % input_id)
+        return moose.element(path)
                
                 
     def createInputs(self):
+        if not self.network.explicit_inputs and not self.network.input_lists:
+            return
         for el in self.network.explicit_inputs:
-            pop_id = el.target.split('[')[0]
-            i = el.target.split('[')[1].split(']')[0]
-            seg_id = 0
-            if '/' in el.target:
-                seg_id = el.target.split('/')[1]
+            m = _target_rex.match(el.target)
+            if m is not None:
+                pop_id, i, seg_id = m.group(1), m.group(2), m.group(3) or 0
+            else:
+                pop_id = el.target.split('[')[0]
+                i = el.target.split('[')[1].split(']')[0]
+                seg_id = 0
+                if '/' in el.target:
+                    seg_id = el.target.split('/')[1]
             input = self.getInput(el.input)
             moose.connect(input, 'output', self.getComp(pop_id,i,seg_id), 'injectMsg')
             
@@ -278,7 +434,7 @@ class NML2Reader(object):
         """
         morphology = nmlcell.morphology
         segments = morphology.segments
-        id_to_segment = dict([(seg.id, seg) for seg in segments])    
+        id_to_segment = {seg.id: seg for seg in segments}
         if symmetric:
             compclass = moose.SymCompartment
         else:
@@ -301,49 +457,103 @@ class NML2Reader(object):
             src, dst = 'axial', 'raxial'
         else:
             src, dst = 'proximal', 'distal'
-        for segid, comp in id_to_comp.items():
+        # First pass: gather the end points into (N, 4) arrays of
+        # (x, y, z, diameter) so lengths and mean diameters come out
+        # of a few vectorized operations instead of per-segment Python
+        # arithmetic.
+        seg_order = list(id_to_comp.items())
+        nseg = len(seg_order)
+        parents = [None] * nseg
+        prox = np.empty((nseg, 4))
+        dist = np.empty((nseg, 4))
+        for idx, (segid, comp) in enumerate(seg_order):
             segment = id_to_segment[segid]
             try:
-                parent = id_to_segment[segment.parent.segments]
+                parents[idx] = id_to_segment[segment.parent.segments]
             except AttributeError:
-                parent = None
+                pass
             self.moose_to_nml[comp] = segment
-            self.nml_segs_to_moose[segment.id] = comp            
-            p0 = segment.proximal            
+            self.nml_segs_to_moose[segment.id] = comp
+            p0 = segment.proximal
             if p0 is None:
-                if parent:
-                    p0 = parent.distal
+                if parents[idx]:
+                    p0 = parents[idx].distal
                 else:
                     raise Exception('No proximal point and no parent segment for segment: name=%s, id=%s' % (segment.name, segment.id))
-            comp.x0, comp.y0, comp.z0 = (x * self.lunit for x in map(float, (p0.x, p0.y, p0.z)))
             p1 = segment.distal
-            comp.x, comp.y, comp.z = (x * self.lunit for x in map(float, (p1.x, p1.y, p1.z)))
-            comp.length = np.sqrt((comp.x - comp.x0)**2
-                                  + (comp.y - comp.y0)**2
-                                  + (comp.z - comp.z0)**2)
-            # This can pose problem with moose where both ends of
-            # compartment have same diameter. We are averaging the two
-            # - may be splitting the compartment into two is better?
-            comp.diameter = (float(p0.diameter)+float(p1.diameter)) * self.lunit / 2
+            prox[idx] = [float(p0.x), float(p0.y), float(p0.z), float(p0.diameter)]
+            dist[idx] = [float(p1.x), float(p1.y), float(p1.z), float(p1.diameter)]
+        prox *= self.lunit
+        dist *= self.lunit
+        lengths = np.sqrt(((dist[:, :3] - prox[:, :3]) ** 2).sum(axis=1))
+        # This can pose problem with moose where both ends of
+        # compartment have same diameter. We are averaging the two
+        # - may be splitting the compartment into two is better?
+        diameters = (prox[:, 3] + dist[:, 3]) / 2
+        sareas = np.where(lengths > 0,
+                          lengths * diameters,
+                          diameters * diameters) * np.pi
+        xareas = diameters * diameters * (np.pi / 4.0)
+        self._seg_geom[nmlcell.id] = dict(
+            (segid, SegGeom(lengths[idx], diameters[idx],
+                            sareas[idx], xareas[idx]))
+            for idx, (segid, comp) in enumerate(seg_order))
+        # Second pass: assign the computed geometry field by field from
+        # the coordinate arrays, then connect up axial resistances.
+        comps = [comp for segid, comp in seg_order]
+        for field, values in (('x0', prox[:, 0]), ('y0', prox[:, 1]),
+                              ('z0', prox[:, 2]), ('x', dist[:, 0]),
+                              ('y', dist[:, 1]), ('z', dist[:, 2]),
+                              ('length', lengths), ('diameter', diameters)):
+            _bulk_set(field, comps, values)
+        for idx, (segid, comp) in enumerate(seg_order):
+            parent = parents[idx]
             if parent:
                 pcomp = id_to_comp[parent.id]
                 moose.connect(comp, src, pcomp, dst)
-        sg_to_segments = {}        
-        for sg in morphology.segment_groups:
-            sg_to_segments[sg.id] = [id_to_segment[m.segments] for m in sg.members]
+        # Expand the segment groups once per cell: direct members
+        # first, then the transitive closure over <include> computed
+        # by iterating to a fixed point with set unions instead of
+        # nested append loops (includes may reference groups that
+        # themselves only include other groups).
+        sg_member_ids = {}
+        sg_include_ids = {}
         for sg in morphology.segment_groups:
-            if not sg.id in sg_to_segments:
-                sg_to_segments[sg.id] = []
-            for inc in sg.includes:
-                for cseg in sg_to_segments[inc.segment_groups]:
-                    sg_to_segments[sg.id].append(cseg)
-            
+            sg_member_ids[sg.id] = set(m.segments for m in sg.members)
+            sg_include_ids[sg.id] = [inc.segment_groups for inc in sg.includes]
+        changed = True
+        while changed:
+            changed = False
+            for sg_id, inc_ids in sg_include_ids.items():
+                members = sg_member_ids[sg_id]
+                before = len(members)
+                for inc_id in inc_ids:
+                    members |= sg_member_ids.get(inc_id, set())
+                if len(members) != before:
+                    changed = True
+        sg_to_segments = dict((sg_id,
+                               [id_to_segment[sid] for sid in sorted(seg_ids)])
+                              for sg_id, seg_ids in sg_member_ids.items())
         if not 'all' in sg_to_segments:
             sg_to_segments['all'] = [ s for s in segments ]
-            
+
         self._cell_to_sg[nmlcell.id] = sg_to_segments
         return id_to_comp, id_to_segment, sg_to_segments
 
+    def _getSegments(self, nmlcell, component):
+        """Memoizing wrapper around `getSegments`. The capacitance,
+        resistivity, species and channel importers all expand the same
+        segment groups of a cell, so the unique segment list is cached
+        per (cell, segment group)."""
+        key = (nmlcell.id, component.segment_groups)
+        try:
+            return self._seg_cache[key]
+        except KeyError:
+            segments = getSegments(nmlcell, component,
+                                   self._cell_to_sg[nmlcell.id])
+            self._seg_cache[key] = segments
+            return segments
+
     def importBiophysics(self, nmlcell, moosecell):
         """Create the biophysical components in moose Neuron `moosecell`
         according to NeuroML2 cell `nmlcell`."""
@@ -364,31 +574,32 @@ class NML2Reader(object):
 
     def importCapacitances(self, nmlcell, moosecell, specificCapacitances):
         sg_to_segments = self._cell_to_sg[nmlcell.id]
+        seg_geom = self._seg_geom[nmlcell.id]
         for specific_cm in specificCapacitances:
             cm = SI(specific_cm.value)
-            for seg in sg_to_segments[specific_cm.segment_groups]:
-                comp = self.nml_segs_to_moose[seg.id]
-                comp.Cm = sarea(comp) * cm
+            segs = sg_to_segments[specific_cm.segment_groups]
+            comps = [self.nml_segs_to_moose[seg.id] for seg in segs]
+            _bulk_set('Cm', comps,
+                      [seg_geom[seg.id].sarea * cm for seg in segs])
                 
     def importInitMembPotential(self, nmlcell, moosecell, membraneProperties):
         sg_to_segments = self._cell_to_sg[nmlcell.id]
         for imp in membraneProperties.init_memb_potentials:
             initv = SI(imp.value)
-            for seg in sg_to_segments[imp.segment_groups]:
-                comp = self.nml_segs_to_moose[seg.id]
-                comp.initVm = initv 
+            comps = [self.nml_segs_to_moose[seg.id]
+                     for seg in sg_to_segments[imp.segment_groups]]
+            _bulk_set('initVm', comps, initv)
 
     def importIntracellularProperties(self, nmlcell, moosecell, properties):
         self.importAxialResistance(nmlcell, properties)
         self.importSpecies(nmlcell, properties)
 
     def importSpecies(self, nmlcell, properties):
-        sg_to_segments = self._cell_to_sg[nmlcell.id]
         for species in properties.species:
             if (species.concentration_model is not None) and \
                (species.concentration_model.id  not in self.proto_pools):
                 continue
-            segments = getSegments(nmlcell, species, sg_to_segments)
+            segments = self._getSegments(nmlcell, species)
             for seg in segments:
                 comp = self.nml_segs_to_moose[seg.id]    
                 self.copySpecies(species, comp)
@@ -397,13 +608,11 @@ class NML2Reader(object):
         """Copy the prototype pool `species` to compartment. Currently only
         decaying pool of Ca2+ supported"""
         proto_pool = None
-        if species.concentrationModel in self.proto_pools:
+        if species.concentration_model in self.proto_pools:
             proto_pool = self.proto_pools[species.concentration_model]
         else:
-            for innerReader in self.includes.values():
-                if species.concentrationModel in innerReader.proto_pools:
-                    proto_pool = innerReader.proto_pools[species.concentrationModel]
-                    break
+            self._loadIncludesFor(species.concentration_model)
+            proto_pool = self.proto_pools.get(species.concentration_model)
         if not proto_pool:
             raise Exception('No prototype pool for %s referred to by %s' % (species.concentration_model, species.id))
         pool_id = moose.copy(proto_pool, comp, species.id)
@@ -412,12 +621,19 @@ class NML2Reader(object):
         return pool
 
     def importAxialResistance(self, nmlcell, intracellularProperties):
-        sg_to_segments = self._cell_to_sg[nmlcell.id]
+        seg_geom = self._seg_geom[nmlcell.id]
         for r in intracellularProperties.resistivities:
-            segments = getSegments(nmlcell, r, sg_to_segments)
+            segments = self._getSegments(nmlcell, r)
+            resistivity = SI(r.value)
+            comps = [self.nml_segs_to_moose[seg.id] for seg in segments]
+            ra = []
             for seg in segments:
-                comp = self.nml_segs_to_moose[seg.id]
-                setRa(comp, SI(r.value))     
+                geom = seg_geom[seg.id]
+                if geom.length > 0:
+                    ra.append(resistivity * geom.length / geom.xarea)
+                else:
+                    ra.append(resistivity * 8.0 / (geom.diameter * np.pi))
+            _bulk_set('Ra', comps, ra)
                 
     def isPassiveChan(self,chan):
         if chan.type == 'ionChannelPassive':
@@ -434,18 +650,64 @@ class NML2Reader(object):
         'HHExpLinearRate': linoid2 }
 
     def calculateRateFn(self, ratefn, vmin, vmax, tablen=3000, vShift='0mV'):
-        """Returns A / B table from ngate."""
-        tab = np.linspace(vmin, vmax, tablen)
+        """Returns A / B table from ngate. Channels commonly share the
+        same rate definitions, so computed tables are cached keyed on
+        the rate parameters and table range. createHHChannel only
+        reads the returned arrays (every combination with q10 or
+        alpha/beta allocates fresh output), so the cached array can be
+        shared between gates."""
+        key = (ratefn.type,
+               getattr(ratefn, 'midpoint', None),
+               getattr(ratefn, 'rate', None),
+               getattr(ratefn, 'scale', None),
+               vmin, vmax, tablen, vShift)
+        table = self._rate_cache.get(key)
+        if table is None:
+            table = self._computeRateFn(ratefn, vmin, vmax, tablen, vShift)
+            if table is not None:
+                self._rate_cache[key] = table
+        return table
+
+    def _getVtab(self, vmin, vmax, tablen):
+        """Return the voltage sample array for the given range. Every
+        gate of every channel asks for the same array, so it is
+        allocated once and shared; it must be treated as read-only."""
+        key = (vmin, vmax, tablen)
+        tab = self._vtab_cache.get(key)
+        if tab is None:
+            tab = np.linspace(vmin, vmax, tablen)
+            self._vtab_cache[key] = tab
+        return tab
+
+    def _getTableBuffers(self, tablen):
+        """Return reusable (tableA, tableB) output buffers for the fused
+        table kernels. The buffers are only valid until the next gate
+        is built; moose copies the values on field assignment."""
+        bufs = self._table_bufs.get(tablen)
+        if bufs is None:
+            bufs = (np.empty(tablen), np.empty(tablen))
+            self._table_bufs[tablen] = bufs
+        return bufs
+
+    def _computeRateFn(self, ratefn, vmin, vmax, tablen=3000, vShift='0mV'):
+        """Compute the A / B table from ngate."""
+        tab = self._getVtab(vmin, vmax, tablen)
         if self._is_standard_nml_rate(ratefn):
             midpoint, rate, scale = map(SI, (ratefn.midpoint, ratefn.rate, ratefn.scale))
             return self.rate_fn_map[ratefn.type](tab, rate, scale, midpoint)
         else:
-            for ct in self.doc.ComponentType:
+            for ct in self._findComponentTypes(ratefn.type):
                 if ratefn.type == ct.name:
                     print("Using %s to evaluate rate"%ct.name)
+                    temperature = self._getTemperature()
+                    rate = self._evaluateComponentTypeBatch(ct, tab, vShift, temperature)
+                    if rate is not None:
+                        return rate
+                    # Fall back to evaluating the component once per
+                    # voltage when the expressions cannot be batched.
                     rate = []
                     for v in tab:
-                        vals = pynml.evaluate_component(ct,req_variables={'v':'%sV'%v,'vShift':vShift,'temperature':self._getTemperature()})
+                        vals = pynml.evaluate_component(ct,req_variables={'v':'%sV'%v,'vShift':vShift,'temperature':temperature})
                         '''print vals'''
                         if 'x' in vals:
                             rate.append(vals['x'])
@@ -455,45 +717,128 @@ class NML2Reader(object):
                             rate.append(vals['r'])
                     return np.array(rate)
 
+    def _compileComponentType(self, ct):
+        """Compile the constants and derived variables of ComponentType `ct`
+        for batch evaluation over a voltage array. Returns a
+        (constants, exprs) pair where `constants` maps names to SI
+        floats and `exprs` is the ordered list of (name, code object)
+        for the derived variables. Returns None if the ComponentType
+        uses constructs that cannot be evaluated on whole arrays
+        (e.g. conditional derived variables); callers should then fall
+        back to per-voltage evaluation.
+        """
+        try:
+            dynamics = ct.Dynamics[0]
+        except (AttributeError, IndexError, TypeError):
+            return None
+        if getattr(dynamics, 'ConditionalDerivedVariable', None):
+            return None
+        to_si = getattr(pynml, 'get_value_in_si', SI)
+        constants = {}
+        try:
+            for c in ct.Constant:
+                constants[c.name] = float(to_si(c.value))
+        except (AttributeError, ValueError, TypeError):
+            return None
+        derived = getattr(dynamics, 'DerivedVariable', None)
+        if not derived:
+            return None
+        exprs = []
+        for dv in derived:
+            if dv.value is None:
+                return None
+            try:
+                code = compile(dv.value.replace('^', '**'),
+                               '<%s:%s>' % (ct.name, dv.name), 'eval')
+            except SyntaxError:
+                return None
+            exprs.append((dv.name, code))
+        return constants, exprs
+
+    def _evaluateComponentTypeBatch(self, ct, tab, vShift, temperature):
+        """Evaluate the rate expressions of ComponentType `ct` over the whole
+        voltage array `tab` in one pass.
+
+        pynml.evaluate_component handles one voltage at a time, so the
+        per-voltage loop costs thousands of Python-level evaluations
+        per gate. Here the expressions are compiled once (cached on
+        the reader, keyed by ct.name) and evaluated with NumPy arrays,
+        producing the whole table in a few vectorized operations.
+        Returns None when the ComponentType cannot be batched.
+        """
+        if ct.name not in self._comp_type_eval:
+            self._comp_type_eval[ct.name] = self._compileComponentType(ct)
+        compiled = self._comp_type_eval[ct.name]
+        if compiled is None:
+            return None
+        constants, exprs = compiled
+        ns = {'exp': np.exp, 'log': np.log, 'sqrt': np.sqrt,
+              'sin': np.sin, 'cos': np.cos, 'tanh': np.tanh,
+              'pi': np.pi}
+        ns.update(constants)
+        ns['v'] = tab
+        ns['vShift'] = SI(vShift)
+        ns['temperature'] = temperature
+        try:
+            for name, code in exprs:
+                ns[name] = eval(code, ns)
+        except Exception:
+            return None
+        names = [name for name, code in exprs]
+        vals = [ns[n] for n in ('x', 't', 'r') if n in names]
+        if len(vals) != 1:
+            # zero or several outputs - let the per-voltage loop
+            # reproduce the historical ordering
+            return None
+        rate = np.asarray(vals[0], dtype=float)
+        if rate.shape != tab.shape: # expression independent of v
+            rate = np.full_like(tab, float(rate))
+        return rate
+
     def importChannelsToCell(self, nmlcell, moosecell, membrane_properties):
-        sg_to_segments = self._cell_to_sg[nmlcell.id]
         for chdens in membrane_properties.channel_densities + membrane_properties.channel_density_v_shifts:
-            segments = getSegments(nmlcell, chdens, sg_to_segments)
+            segments = self._getSegments(nmlcell, chdens)
             condDensity = SI(chdens.cond_density)
             erev = SI(chdens.erev)
             try:
                 ionChannel = self.id_to_ionChannel[chdens.ion_channel]
             except KeyError:
-                print('No channel with id', chdens.ion_channel)                
-                continue
+                self._loadIncludesFor(chdens.ion_channel)
+                ionChannel = self.id_to_ionChannel.get(chdens.ion_channel)
+                if ionChannel is None:
+                    print('No channel with id', chdens.ion_channel)
+                    continue
                 
             if self.verbose:
                 print('Setting density of channel %s in %s to %s; erev=%s (passive: %s)'%(chdens.id, segments, condDensity,erev,self.isPassiveChan(ionChannel)))
             
+            seg_geom = self._seg_geom[nmlcell.id]
             if self.isPassiveChan(ionChannel):
-                for seg in segments:
-                    comp = self.nml_segs_to_moose[seg.id]
-                    setRm(comp, condDensity)
-                    setEk(comp, erev)
+                comps = [self.nml_segs_to_moose[seg.id] for seg in segments]
+                _bulk_set('Rm', comps,
+                          [1.0 / (condDensity * seg_geom[seg.id].sarea)
+                           for seg in segments])
+                _bulk_set('Em', comps, erev)
             else:
                 for seg in segments:
-                    self.copyChannel(chdens, self.nml_segs_to_moose[seg.id], condDensity, erev)
+                    self.copyChannel(chdens, self.nml_segs_to_moose[seg.id],
+                                     condDensity, erev,
+                                     area=seg_geom[seg.id].sarea)
             '''moose.le(self.nml_segs_to_moose[seg.id])
             moose.showfield(self.nml_segs_to_moose[seg.id], field="*", showtype=True)'''
 
-    def copyChannel(self, chdens, comp, condDensity, erev):
+    def copyChannel(self, chdens, comp, condDensity, erev, area=None):
         """Copy moose prototype for `chdens` condutcance density to `comp`
-        compartment.
+        compartment. `area` is the precomputed surface area of `comp`;
+        when omitted it is computed from the compartment geometry.
 
         """
         proto_chan = None
         if chdens.ion_channel in self.proto_chans:
             proto_chan = self.proto_chans[chdens.ion_channel]
         else:
-            for innerReader in self.includes.values():
-                if chdens.ionChannel in innerReader.proto_chans:
-                    proto_chan = innerReader.proto_chans[chdens.ion_channel]
-                    break
+            self._loadIncludesFor(chdens.ion_channel)
+            proto_chan = self.proto_chans.get(chdens.ion_channel)
         if not proto_chan:
             raise Exception('No prototype channel for %s referred to by %s' % (chdens.ion_channel, chdens.id))
 
@@ -502,15 +847,91 @@ class NML2Reader(object):
         orig = chdens.id
         chid = moose.copy(proto_chan, comp, chdens.id)
         chan = moose.element(chid)
-        els = list(self.paths_to_chan_elements.keys())
-        for p in els:
-            pp = p.replace('%s/'%chdens.ion_channel,'%s/'%orig)
-            self.paths_to_chan_elements[pp] = self.paths_to_chan_elements[p].replace('%s/'%chdens.ion_channel,'%s/'%orig)
+        # Record the gate entries for this clone directly from the
+        # prototype's gate map; rewriting every existing key made each
+        # copy cost O(entries so far).
+        for gate_id, mgate_name in self._chan_to_gates.get(chdens.ion_channel, []):
+            self.paths_to_chan_elements['%s/%s' % (orig, gate_id)] = '%s/%s' % (orig, mgate_name)
         #print(self.paths_to_chan_elements)
-        chan.Gbar = sarea(comp) * condDensity
+        if area is None:
+            area = sarea(comp)
+        chan.Gbar = area * condDensity
         chan.Ek = erev
         moose.connect(chan, 'channel', comp, 'channel')
-        return chan    
+        return chan
+
+    def _resolveIncludePath(self, href):
+        """Return the path of include `href`, looking relative to the
+        current file as well, or None if no such file exists."""
+        for path in (href, os.path.join(os.path.dirname(self.filename), href)):
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def _includeDeclares(self, href, id):
+        """True if included file `href` declares `id` (or if that cannot
+        be determined without parsing it)."""
+        if href not in self._include_decls:
+            path = self._resolveIncludePath(href)
+            try:
+                self._include_decls[href] = set(
+                    v for vals in _scanDeclaredIds(path).values() for v in vals)
+            except (ImportError, OSError, TypeError):
+                self._include_decls[href] = None # unknown - must parse
+        decls = self._include_decls[href]
+        return decls is None or id in decls
+
+    def _load_include(self, href):
+        """Read included file `href` with a nested reader, creating its
+        prototypes under /library and merging its lookup maps into this
+        reader. Wrapped with lru_cache in __init__ so each include is
+        parsed once however many ids refer into it."""
+        path = self._resolveIncludePath(href)
+        if path is None:
+            raise IOError('Could not find included file %s (relative to %s)'
+                          % (href, self.filename))
+        if self.verbose:
+            print(self.filename, 'Loading include', href)
+        # The included file has no network element, so the nested
+        # reader must inherit this model's temperature - its channel
+        # prototypes (q10 scaling, custom rates) are built during the
+        # nested read.
+        inner = NML2Reader(self.verbose, temperature=self._getTemperature())
+        inner.read(path, symmetric=self._symmetric)
+        self.includes[href] = inner
+        self.id_to_ionChannel.update(inner.id_to_ionChannel)
+        self.proto_chans.update(inner.proto_chans)
+        self.proto_cells.update(inner.proto_cells)
+        self.proto_pools.update(inner.proto_pools)
+        self.seg_id_to_comp_name.update(inner.seg_id_to_comp_name)
+        self.moose_to_nml.update(inner.moose_to_nml)
+        self.paths_to_chan_elements.update(inner.paths_to_chan_elements)
+        self._chan_to_gates.update(inner._chan_to_gates)
+        return inner
+
+    def _loadIncludesFor(self, id):
+        """Parse the included files that declare `id`, on demand. Files
+        whose id scan shows they do not declare it are left unparsed."""
+        for href in self._include_hrefs:
+            if href in self.includes:
+                continue
+            if self._includeDeclares(href, id):
+                self._load_include(href)
+
+    def _findComponentTypes(self, name):
+        """Yield the ComponentTypes matching `name`, looking in this
+        document first and then in lazily loaded includes."""
+        found = False
+        for ct in self.doc.ComponentType:
+            if ct.name == name:
+                found = True
+                yield ct
+        if not found:
+            self._loadIncludesFor(name)
+            for inner in self.includes.values():
+                for ct in inner.doc.ComponentType:
+                    if ct.name == name:
+                        yield ct
 
     '''
     def importIncludes(self, doc):        
@@ -574,13 +995,22 @@ class NML2Reader(object):
             rev = ngate.reverse_rate
             
             self.paths_to_chan_elements['%s/%s'%(chan.id,ngate.id)] = '%s/%s'%(chan.id,mgate.name)
+            self._chan_to_gates.setdefault(chan.id, []).append((ngate.id, mgate.name))
                 
             q10_scale = 1
             if ngate.q10_settings:
                 if ngate.q10_settings.type == 'q10Fixed':
                     q10_scale= float(ngate.q10_settings.fixed_q10)
                 elif ngate.q10_settings.type == 'q10ExpTemp':
-                    q10_scale = math.pow(float(ngate.q10_settings.q10_factor),(self._getTemperature()- SI(ngate.q10_settings.experimental_temp))/10)
+                    # Gates across channels mostly share the same q10
+                    # settings; cache the scale to avoid re-parsing the
+                    # experimental temperature per gate.
+                    q10_key = (ngate.q10_settings.q10_factor,
+                               ngate.q10_settings.experimental_temp)
+                    q10_scale = self._q10_cache.get(q10_key)
+                    if q10_scale is None:
+                        q10_scale = float(ngate.q10_settings.q10_factor) ** ((self._getTemperature()- SI(ngate.q10_settings.experimental_temp))/10)
+                        self._q10_cache[q10_key] = q10_scale
                     #print('Q10: %s; %s; %s; %s'%(ngate.q10_settings.q10_factor, self._getTemperature(),SI(ngate.q10_settings.experimental_temp),q10_scale))
                 else:
                     raise Exception('Unknown Q10 scaling type %s: %s'%(ngate.q10_settings.type,ngate.q10_settings))
@@ -591,8 +1021,9 @@ class NML2Reader(object):
             if (fwd is not None) and (rev is not None):
                 alpha = self.calculateRateFn(fwd, vmin, vmax, vdivs)
                 beta = self.calculateRateFn(rev, vmin, vmax, vdivs)
-                mgate.tableA = q10_scale * (alpha)
-                mgate.tableB = q10_scale * (alpha + beta)
+                bufA, bufB = self._getTableBuffers(vdivs)
+                mgate.tableA, mgate.tableB = fuse_ab(q10_scale, alpha, beta,
+                                                     bufA, bufB)
             # Assuming the meaning of the elements in GateHHTauInf ...
             if hasattr(ngate,'time_course') and hasattr(ngate,'steady_state') \
                and (ngate.time_course is not None) and (ngate.steady_state is not None):
@@ -600,16 +1031,18 @@ class NML2Reader(object):
                 inf = ngate.steady_state
                 tau = self.calculateRateFn(tau, vmin, vmax, vdivs)
                 inf = self.calculateRateFn(inf, vmin, vmax, vdivs)
-                mgate.tableA = q10_scale * (inf / tau)
-                mgate.tableB = q10_scale * (1 / tau)
-                
+                bufA, bufB = self._getTableBuffers(vdivs)
+                mgate.tableA, mgate.tableB = fuse_inf_tau(q10_scale, inf, tau,
+                                                          bufA, bufB)
+
             if hasattr(ngate,'steady_state') and (ngate.time_course is None) and (ngate.steady_state is not None):
                 inf = ngate.steady_state
                 tau = 1 / (alpha + beta)
                 if (inf is not None):
                     inf = self.calculateRateFn(inf, vmin, vmax, vdivs)
-                    mgate.tableA = q10_scale * (inf / tau)
-                    mgate.tableB = q10_scale * (1 / tau)
+                    bufA, bufB = self._getTableBuffers(vdivs)
+                    mgate.tableA, mgate.tableB = fuse_inf_tau(q10_scale, inf,
+                                                              tau, bufA, bufB)
                 
         if self.verbose:
             print(self.filename, '== Created', mchan.path, 'for', chan.id)
@@ -622,6 +1055,8 @@ class NML2Reader(object):
         return mchan
 
     def importInputs(self, doc):
+        if not doc.pulse_generators:
+            return
         minputs = moose.Neutral('%s/inputs' % (self.lib.path))
         for pg_nml in doc.pulse_generators:
 
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# test_hhjit.py ---
+#
+# Filename: test_hhjit.py
+# Description: Tests for the fused HH rate-table kernels.
+# Maintainer:
+# Version:
+# URL:
+# Keywords:
+# Compatibility:
+#
+#
+
+# Commentary:
+#
+# The fuse_ab/fuse_inf_tau kernels must reproduce the NumPy
+# expressions they replaced in createHHChannel, whichever backend
+# (numba or the NumPy fallback) is active.
+#
+#
+
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street, Fifth
+# Floor, Boston, MA 02110-1301, USA.
+#
+#
+
+# Code:
+
+from __future__ import print_function
+import unittest
+import numpy as np
+
+from moose.neuroml2.hhjit import fuse_ab, fuse_inf_tau
+
+
+class TestFusedKernels(unittest.TestCase):
+    def setUp(self):
+        self.q10 = 2.5
+        rng = np.random.RandomState(42)
+        self.alpha = rng.uniform(0.1, 1e3, 200)
+        self.beta = rng.uniform(0.1, 1e3, 200)
+        self.inf = rng.uniform(0.0, 1.0, 200)
+        self.tau = rng.uniform(1e-4, 1e-1, 200)
+        self.bufA = np.empty(200)
+        self.bufB = np.empty(200)
+
+    def test_fuse_ab(self):
+        tableA, tableB = fuse_ab(self.q10, self.alpha, self.beta,
+                                 self.bufA, self.bufB)
+        np.testing.assert_allclose(tableA, self.q10 * self.alpha)
+        np.testing.assert_allclose(tableB, self.q10 * (self.alpha + self.beta))
+
+    def test_fuse_inf_tau(self):
+        tableA, tableB = fuse_inf_tau(self.q10, self.inf, self.tau,
+                                      self.bufA, self.bufB)
+        np.testing.assert_allclose(tableA, self.q10 * self.inf / self.tau)
+        np.testing.assert_allclose(tableB, self.q10 / self.tau)
+
+    def test_writesIntoBuffers(self):
+        """The kernels must fill the supplied buffers, not allocate."""
+        tableA, tableB = fuse_ab(self.q10, self.alpha, self.beta,
+                                 self.bufA, self.bufB)
+        self.assertIs(tableA, self.bufA)
+        self.assertIs(tableB, self.bufB)
+
+    def test_unitQ10(self):
+        """q10_scale defaults to the int 1 in createHHChannel."""
+        tableA, tableB = fuse_ab(1, self.alpha, self.beta,
+                                 self.bufA, self.bufB)
+        np.testing.assert_allclose(tableA, self.alpha)
+        np.testing.assert_allclose(tableB, self.alpha + self.beta)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+#
+# test_hhjit.py ends here
@@ -47,6 +47,7 @@
 # Code:
 
 from __future__ import print_function
+import math
 import unittest
 import numpy as np
 import moose
@@ -145,6 +146,57 @@ class TestGran98(unittest.TestCase):
         pass
 '''
 
+class _CTStub(object):
+    """Minimal stand-in for a libNeuroML ComponentType."""
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class TestComponentTypeBatchEval(unittest.TestCase):
+    """The batched ComponentType evaluator must agree with evaluating
+    the same expressions one voltage at a time, which is what the
+    per-voltage fallback in _computeRateFn does."""
+    def setUp(self):
+        self.reader = NML2Reader()
+        self.vshift = 10e-3
+        self.ct = _CTStub(
+            name='customRate',
+            Constant=[_CTStub(name='TIME_SCALE', value='1s'),
+                      _CTStub(name='VOLT_SCALE', value='1V')],
+            Dynamics=[_CTStub(
+                DerivedVariable=[
+                    _CTStub(name='V', value='(v - vShift) / VOLT_SCALE'),
+                    _CTStub(name='x', value='1000 * exp(V / 0.04) / TIME_SCALE')],
+                ConditionalDerivedVariable=[])])
+
+    def test_batchMatchesPerVoltage(self):
+        tab = np.linspace(-100e-3, 50e-3, 50)
+        batch = self.reader._evaluateComponentTypeBatch(
+            self.ct, tab, '10mV', 0)
+        self.assertIsNotNone(batch)
+        pervolt = [1000 * math.exp((v - self.vshift) / 0.04) for v in tab]
+        np.testing.assert_allclose(batch, np.array(pervolt))
+
+    def test_conditionalFallsBack(self):
+        """ComponentTypes with conditional derived variables cannot be
+        batched - the evaluator must return None so the caller uses the
+        per-voltage loop."""
+        ct = _CTStub(name='condRate',
+                     Constant=[],
+                     Dynamics=[_CTStub(
+                         DerivedVariable=[],
+                         ConditionalDerivedVariable=[_CTStub(name='x')])])
+        self.assertIsNone(self.reader._evaluateComponentTypeBatch(
+            ct, np.linspace(-100e-3, 50e-3, 10), '0mV', 0))
+
+    def test_malformedFallsBack(self):
+        """A ComponentType without Constant/DerivedVariable attributes
+        must fall back, not abort the read."""
+        ct = _CTStub(name='noDynamics', Dynamics=[])
+        self.assertIsNone(self.reader._evaluateComponentTypeBatch(
+            ct, np.linspace(-100e-3, 50e-3, 10), '0mV', 0))
+
+
 if __name__ == '__main__':
     unittest.main()
 
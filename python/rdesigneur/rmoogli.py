@@ -10,7 +10,6 @@
 #########################################################################
 
 import math
-import matplotlib
 import sys
 import moose
 import os
@@ -26,10 +25,24 @@ if not display:
             "Anyway, MOOSE will continue without graphics.\n"
             )
 
-hasMoogli = True
-
-if hasDisplay:
+hasMoogli = hasDisplay
+app = None
+moogli = None
+matplotlib = None
+
+def _loadMoogli():
+    """Import matplotlib, PyQt4 and moogli and create the QApplication
+    on first use. rdesigneur imports this module unconditionally, so
+    loading the GUI stack at import time made every headless
+    simulation pay for PyQt4 and OpenGL; now only the first moogli
+    call does."""
+    global hasMoogli, app, moogli, matplotlib
+    if not hasMoogli:
+        return False
+    if moogli is not None:
+        return True
     try:
+        import matplotlib
         from PyQt4 import QtGui
         import moogli
         import moogli.extensions.moose
@@ -37,6 +50,8 @@ if hasDisplay:
     except Exception as e:
         print( 'Warning: Moogli not found. All moogli calls will use dummy functions' )
         hasMoogli = False
+        return False
+    return True
 
 
 runtime = 0.0
@@ -82,7 +97,7 @@ def postlude( view ):
     view.rd.display()
 
 def makeMoogli( rd, mooObj, moogliEntry, fieldInfo ):
-    if not hasMoogli:
+    if not _loadMoogli():
         return None
     mooField = moogliEntry[3]
     numMoogli = len( mooObj )
@@ -158,7 +173,7 @@ def makeMoogli( rd, mooObj, moogliEntry, fieldInfo ):
     return viewer
 
 def displayMoogli( rd, _dt, _runtime, _rotation ):
-    if not hasMoogli:
+    if not _loadMoogli():
         return None
     global runtime
     global moogliDt